@@ -3,11 +3,15 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import concurrent.futures
 import itertools
+import os
 import shutil
+import signal
 import subprocess
 import sys
-from typing import Iterator, List, Tuple
+from types import FrameType
+from typing import Iterator, List, Optional, Tuple
 import warnings
 
 import numpy
@@ -120,6 +124,15 @@ commands differ significantly, we report the relation.
         help="run command1 repeatedly and then run command2 repeatedly",
     )
 
+    parser.add_argument(
+        "-j",
+        "--parallel",
+        type=int,
+        default=1,
+        metavar="K",
+        help="with --consecutive, run up to K commands at the same time; only use this for benchmarks that aren't affected by other load on the machine",
+    )
+
     parser.add_argument(
         "-t",
         "--command-template",
@@ -135,6 +148,13 @@ commands differ significantly, we report the relation.
         metavar="N",
         help="additional number of times to run each command before collecting data",
     )
+    parser.add_argument(
+        "--cpu",
+        type=int,
+        action="append",
+        metavar="CPU",
+        help="only run commands on the given CPU, which reduces variance from migrations between CPUs; may be given multiple times",
+    )
     parser.add_argument(
         "--pre",
         type=str,
@@ -171,6 +191,17 @@ commands differ significantly, we report the relation.
         "commands", metavar="command2", action="append", help="second shell command"
     )
     args = parser.parse_args()
+    if args.parallel < 1:
+        parser.error("--parallel must be at least 1")
+    if args.parallel > 1 and getattr(args, "order", None) != "consecutive":
+        parser.error("--parallel requires --consecutive")
+
+    if args.cpu is not None:
+        # Child processes inherit our affinity.
+        try:
+            os.sched_setaffinity(0, args.cpu)
+        except (OSError, ValueError) as e:
+            parser.error(f"--cpu: {e}")
 
     args.commands = [
         args.command_template.replace("{}", command) for command in args.commands
@@ -222,6 +253,16 @@ commands differ significantly, we report the relation.
         num_runs_columns = len(str(num_runs))
         reserved_columns = 2 * num_runs_columns + 4
 
+        # Only get the terminal size when it changes rather than every time we
+        # redraw.
+        columns = shutil.get_terminal_size().columns
+
+        def update_columns(signum: int, frame: Optional[FrameType]) -> None:
+            nonlocal columns
+            columns = shutil.get_terminal_size().columns
+
+        signal.signal(signal.SIGWINCH, update_columns)
+
     prev_num_progress_lines = 0
 
     warnings.filterwarnings("error", category=RuntimeWarning)
@@ -230,7 +271,6 @@ commands differ significantly, we report the relation.
         lines = []
 
         if progress:
-            columns = shutil.get_terminal_size().columns
             if columns > reserved_columns:
                 bar_columns = columns - reserved_columns
                 filled_columns = int(bar_columns * (run / num_runs))
@@ -241,28 +281,31 @@ commands differ significantly, we report the relation.
             progress_bar += f"{run:>{num_runs_columns}}/{num_runs}"
             lines.append(progress_bar)
 
-        for j, (samples1, samples2) in enumerate(populations, 1):
+        for j, population in enumerate(populations, 1):
             if j > 1:
                 lines.append("")
             if len(populations) > 1:
                 lines.append(f"POPULATION {j}:")
+            # Convert each list of samples to an array once rather than in
+            # every NumPy call.
+            samples1, samples2 = [numpy.array(samples) for samples in population]
             means = [
-                numpy.mean(samples1) if samples1 else None,
-                numpy.mean(samples2) if samples2 else None,
+                samples1.mean() if samples1.size else None,
+                samples2.mean() if samples2.size else None,
             ]
             for i, samples in enumerate((samples1, samples2), 1):
-                if samples:
+                if samples.size:
                     lines.append(f"Command {i}:")
                     lines.append(
-                        f"  n = {len(samples)} mean = {means[i - 1]:f} SD = {numpy.std(samples):f}"
+                        f"  n = {samples.size} mean = {means[i - 1]:f} SD = {samples.std():f}"
                     )
                     lines.append(
-                        f"  min = {numpy.min(samples):f} max = {numpy.max(samples):f} median = {numpy.median(samples):f}"
+                        f"  min = {samples.min():f} max = {samples.max():f} median = {numpy.median(samples):f}"
                     )
                     if args.verbose:
                         lines.append(
                             "  samples = "
-                            + ", ".join([f"{sample:f}" for sample in samples])
+                            + ", ".join([f"{sample:f}" for sample in population[i - 1]])
                         )
             if means[0] is not None and means[1] is not None:
                 lines.append(f"Difference of sample means = {means[0] - means[1]:f}")
@@ -303,29 +346,76 @@ commands differ significantly, we report the relation.
         else:
             sys.stdout.flush()
 
-    if progress:
-        sys.stdout.write("\0337")
-    for i, (command_index, record) in enumerate(runs):
-        if progress:
-            print_progress(i)
-
+    def run_command(command_index: int, record: bool) -> List[Tuple[int, float]]:
         if args.pre is not None:
             subprocess.check_call(args.pre, shell=True)
 
-        output = subprocess.check_output(
-            args.commands[command_index], shell=True, universal_newlines=True
-        )
-        if record:
-            for line in output.splitlines():
-                for j, token in enumerate(line.split("\t")):
+        # Parse samples as the command outputs them instead of buffering all
+        # of its output.
+        samples = []
+        with subprocess.Popen(
+            args.commands[command_index],
+            shell=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ) as proc:
+            assert proc.stdout is not None
+            for line in proc.stdout:
+                if not record:
+                    continue
+                for j, token in enumerate(line.rstrip("\n").split("\t")):
                     if token:
-                        if len(populations) <= j:
-                            populations.append(([], []))
-                        populations[j][command_index].append(float(token))
+                        samples.append((j, float(token)))
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
 
         if args.post is not None:
             subprocess.check_call(args.post, shell=True)
 
+        return samples
+
+    def add_samples(command_index: int, samples: List[Tuple[int, float]]) -> None:
+        for j, sample in samples:
+            if len(populations) <= j:
+                populations.append(([], []))
+            populations[j][command_index].append(sample)
+
+    if progress:
+        sys.stdout.write("\0337")
+    if args.parallel > 1:
+        if progress:
+            print_progress(0)
+        # Only recorded runs of the same command overlap: the warmup runs are
+        # run one at a time first, and all of command1's runs finish before
+        # any of command2's start.
+        executor = concurrent.futures.ThreadPoolExecutor(args.parallel)
+        try:
+            i = 0
+            for command_index in range(2):
+                for _ in range(args.warmup):
+                    run_command(command_index, False)
+                    i += 1
+                    if progress and i < num_runs:
+                        print_progress(i)
+                futures = [
+                    executor.submit(run_command, command_index, True)
+                    for _ in range(args.repeat)
+                ]
+                # Add the samples in the order that the runs were started so
+                # that the results don't depend on scheduling.
+                for future in futures:
+                    add_samples(command_index, future.result())
+                    i += 1
+                    if progress and i < num_runs:
+                        print_progress(i)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    else:
+        for i, (command_index, record) in enumerate(runs):
+            if progress:
+                print_progress(i)
+            add_samples(command_index, run_command(command_index, record))
+
     print_progress(num_runs)
 
 
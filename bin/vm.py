@@ -5,21 +5,28 @@
 import argparse
 import configparser
 import errno
-import fcntl
+import functools
+import json
 import os
 from pathlib import Path
-import pty
 import re
-import runpy
-import selectors
 import shlex
 import signal
 import subprocess
 import sys
-import termios
-import tty
-from typing import Any, Dict, List, Optional, Sequence
-import urllib.request
+import time
+from types import CodeType
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+_archiso_re = re.compile(r"archlinux-\d{4}\.\d{2}\.\d{2}-x86_64\.iso")
+_hostname_invalid_re = re.compile(r"[^-a-z0-9]+")
+_drive_cache_re = re.compile(r"(^|,)cache=[^,]*")
+
+# Kernel image built by default for each QEMU architecture.
+_default_image_names = {
+    "aarch64": "arch/arm64/boot/Image",
+    "x86_64": "arch/x86/boot/bzImage",
+}
 
 
 def prompt_yes_no(prompt: str, default: bool = True) -> bool:
@@ -44,6 +51,7 @@ class ScriptConfig:
         self.builds_dir = builds_dir
 
 
+@functools.lru_cache(maxsize=1)
 def get_script_config() -> ScriptConfig:
     config = configparser.ConfigParser()
     config["Paths"] = {"VMs": "~/vms"}
@@ -66,6 +74,75 @@ def get_script_config() -> ScriptConfig:
     )
 
 
+def get_cache_dir() -> Path:
+    xdg_cache_home = os.getenv("XDG_CACHE_HOME")
+    if xdg_cache_home is None:
+        cache_home = Path("~/.cache").expanduser()
+    else:
+        cache_home = Path(xdg_cache_home)
+    return cache_home / "vmpy"
+
+
+def mtime_ns(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_cache(path: Path) -> Any:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# The cache is only an optimization, so failing to write it isn't an error.
+def write_cache(path: Path, value: Any) -> None:
+    import tempfile
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Use a unique temporary file so that concurrent writers don't clobber
+        # each other's.
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".")
+        try:
+            with open(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+
+def get_image_name(build_path: Path) -> str:
+    # make is slow to start, so remember the image name for each build until
+    # its configuration changes.
+    cache_path = get_cache_dir() / "image_name.json"
+    config_mtime = mtime_ns(build_path / ".config")
+    cache = read_cache(cache_path)
+    if not isinstance(cache, dict):
+        cache = {}
+    cached = cache.get(str(build_path))
+    if (
+        config_mtime is not None
+        and isinstance(cached, list)
+        and len(cached) == 2
+        and cached[0] == config_mtime
+        and isinstance(cached[1], str)
+    ):
+        return cached[1]
+    image_name = subprocess.check_output(
+        ["make", "-s", "image_name"], cwd=build_path, universal_newlines=True
+    ).strip()
+    cache[str(build_path)] = [config_mtime, image_name]
+    write_cache(cache_path, cache)
+    return image_name
+
+
 class VMConfig:
     def __init__(
         self,
@@ -91,9 +168,10 @@ class VMConfig:
 
         # Command-line arguments.
         if build_path is not None:
-            image_name = subprocess.check_output(
-                ["make", "-s", "image_name"], cwd=build_path, universal_newlines=True
-            ).strip()
+            # Skip make entirely if the image is where we expect it.
+            image_name = _default_image_names.get(self.qemu_arch)
+            if image_name is None or not (build_path / image_name).exists():
+                image_name = get_image_name(build_path)
             args.extend(("-kernel", str(build_path / image_name)))
             virtfs_opts = [
                 "local",
@@ -120,8 +198,23 @@ class VMConfig:
         return args
 
 
+_config_code_cache: Dict[Path, Tuple[int, CodeType]] = {}
+
+
+def run_config_file(path: Path) -> Dict[str, Any]:
+    mtime = path.stat().st_mtime_ns
+    cached = _config_code_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, compile(path.read_bytes(), str(path), "exec"))
+        _config_code_cache[path] = cached
+    # Same globals as runpy.run_path(), which this used to use.
+    config: Dict[str, Any] = {"__name__": "<run_path>", "__file__": str(path)}
+    exec(cached[1], config)
+    return config
+
+
 def parse_vm_config(vm_dir: Path) -> VMConfig:
-    config = runpy.run_path(str(vm_dir / "config.py"))
+    config = run_config_file(vm_dir / "config.py")
     return VMConfig(
         qemu_arch=config.get("qemu_arch", "x86_64"),
         qemu_options=config.get("qemu_options", []),
@@ -134,6 +227,7 @@ def cmd_create(args: argparse.Namespace, script_config: ScriptConfig) -> None:
     vm_dir.mkdir(parents=True, exist_ok=True)
 
     print(f"Creating {args.name!r}, cpu={args.cpu} memory={args.memory}")
+    image_path = vm_dir / f"{args.name}.qcow2"
     subprocess.run(
         [
             "qemu-img",
@@ -142,11 +236,19 @@ def cmd_create(args: argparse.Namespace, script_config: ScriptConfig) -> None:
             "qcow2",
             "-o",
             "nocow=on",
-            vm_dir / f"{args.name}.qcow2",
+            image_path,
             args.size,
         ],
         check=True,
     )
+    # QEMU opens the image with cache=none, so there's no point in keeping
+    # what qemu-img just wrote in the page cache.
+    fd = os.open(image_path, os.O_RDONLY)
+    try:
+        os.fdatasync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
     with open(vm_dir / "config.py", "w") as f:
         f.write(
             f"""\
@@ -184,7 +286,7 @@ kernel_cmdline = [
 def get_build_path(
     args: argparse.Namespace, script_config: ScriptConfig
 ) -> Optional[Path]:
-    kernel: Optional[str] = getattr(args, "kernel", None)
+    kernel: Optional[str] = args.kernel
     if kernel is None:
         return None
 
@@ -201,8 +303,8 @@ def cmd_run(args: argparse.Namespace, script_config: ScriptConfig) -> None:
     build_path = get_build_path(args, script_config)
     qemu_args = parse_vm_config(script_config.vms_dir / args.name).qemu_args(
         build_path=build_path,
-        initrd=getattr(args, "initrd", None),
-        kernel_cmdline_append=getattr(args, "append", ()),
+        initrd=args.initrd,
+        kernel_cmdline_append=args.append or (),
         extra_args=args.qemu_options,
     )
     if args.dry_run:
@@ -212,11 +314,80 @@ def cmd_run(args: argparse.Namespace, script_config: ScriptConfig) -> None:
         os.execvp(qemu_args[0], qemu_args)
 
 
+def get_archiso_checksum(mirror: str, iso_name: str) -> str:
+    import urllib.request
+
+    with urllib.request.urlopen(mirror + "/sha256sums.txt") as url:
+        for line in url.read().decode().splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[1] == iso_name:
+                return fields[0]
+    sys.exit(f"Checksum for {iso_name} not found on {mirror}")
+
+
+# Download a file, resuming a partial download if there is one, and return
+# the SHA-256 digest of the file.
+def download_file(url: str, path: Path) -> str:
+    import hashlib
+    import urllib.error
+    import urllib.request
+
+    with open(path, "a+b") as f:
+        # Hash what we already have so that the whole file doesn't need to be
+        # read again once it's complete.
+        f.seek(0)
+        if hasattr(hashlib, "file_digest"):
+            h = hashlib.file_digest(f, "sha256")
+        else:
+            h = hashlib.sha256()
+            while True:
+                chunk = f.read(128 * 1024)
+                if not chunk:
+                    break
+                h.update(chunk)
+        offset = f.seek(0, os.SEEK_END)
+
+        request = urllib.request.Request(url)
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            # The partial download is already complete.
+            if offset and e.code == 416:
+                return h.hexdigest()
+            raise
+        with response:
+            if response.status != 206:
+                f.seek(0)
+                f.truncate()
+                h = hashlib.sha256()
+                offset = 0
+            total = response.length
+            if total is not None:
+                total += offset
+            buf = bytearray(1024 * 1024)
+            view = memoryview(buf)
+            while True:
+                n = response.readinto(buf)
+                if not n:
+                    break
+                f.write(view[:n])
+                h.update(view[:n])
+                offset += n
+                if total:
+                    sys.stderr.write(f"\r{offset * 100 // total}% of {total} bytes")
+                    sys.stderr.flush()
+        if total:
+            sys.stderr.write("\n")
+    return h.hexdigest()
+
+
 def download_latest_archiso(mirror: str, isos_dir: Path) -> Path:
+    import urllib.request
+
     with urllib.request.urlopen(mirror) as url:
-        match = re.search(
-            r"archlinux-\d{4}\.\d{2}\.\d{2}-x86_64\.iso", url.read().decode()
-        )
+        match = _archiso_re.search(url.read().decode())
         if not match:
             sys.exit(f"Installer ISO not found on {mirror}")
         latest: str = match.group()
@@ -228,13 +399,12 @@ def download_latest_archiso(mirror: str, isos_dir: Path) -> Path:
             sys.exit(
                 "Use --iso if you have a previously downloaded ISO you want to use"
             )
+        checksum = get_archiso_checksum(mirror, latest)
         isos_dir.mkdir(parents=True, exist_ok=True)
         iso_part = isos_dir / (latest + ".part")
-        subprocess.run(
-            ["curl", "-L", "-C", "-", "-f", "-o", iso_part, iso_url],
-            check=True,
-        )
-        # TODO: check checksum
+        if download_file(iso_url, iso_part) != checksum:
+            iso_part.unlink()
+            sys.exit(f"Checksum mismatch for {iso_url}")
         iso_part.rename(iso_path)
     return iso_path
 
@@ -265,13 +435,12 @@ packages=({' '.join(shlex.quote(package) for package in args.packages)})
 # We want IPv6 Router Advertisement enabled even if the ISO disabled it
 if [[ -d /etc/systemd/network ]]; then
 	find /etc/systemd/network -name '*.network' \
-		-exec sed -i '/^IPv6AcceptRA/d' {} \;
+		-exec sed -i '/^IPv6AcceptRA/d' {} +
 fi
 
 # It'd be nice if we could use networkctl reload instead, but that doesn't wait
 # for the configuration to be reloaded and applied
-systemctl restart systemd-networkd.service
-systemctl restart systemd-networkd-wait-online.service
+systemctl restart systemd-networkd.service systemd-networkd-wait-online.service
 
 # We need pacman-init.service to populate the pacman keyring, but it is
 # configured to run after time-sync.target. If we're behind a firewall, this
@@ -280,21 +449,40 @@ systemctl restart systemd-networkd-wait-online.service
 touch /run/systemd/timesync/synchronized
 systemctl start pacman-init.service
 
-export gateway="$(ip route show default | gawk 'match($0, /^\s*default.*via\s+([0-9.]+)/, a) { print a[1]; exit }')"
+# Set the variable named $1 to the first capture group of the first line of
+# standard input matching the regular expression $2.
+match_line() {
+	local line
+	while read -r line; do
+		if [[ $line =~ $2 ]]; then
+			printf -v "$1" %s "${BASH_REMATCH[1]}"
+			return
+		fi
+	done
+	printf -v "$1" %s ""
+}
+
+route_info="$(ip route show default)"
+
+match_line gateway '^default.*via[[:space:]]+([0-9.]+)' <<< "$route_info"
 [[ -z $gateway ]] && { echo "Could not find gateway" >&2; exit 1; }
 
-export nic="$(ip route show default | gawk 'match($0, /^\s*default.*dev\s+(\S+)/, a) { print a[1]; exit }')"
+match_line nic '^default.*dev[[:space:]]+([^[:space:]]+)' <<< "$route_info"
 [[ -z $nic ]] && { echo "Could not find network interface" >&2; exit 1; }
 
-export ip_address="$(ip addr show dev "$nic" | gawk 'match($0, /^\s*inet\s+([0-9.]+\/[0-9]+)/, a) { print a[1]; exit }')"
+addr_info="$(ip addr show dev "$nic")"
+
+match_line ip_address '^inet[[:space:]]+([0-9.]+/[0-9]+)' <<< "$addr_info"
 [[ -z $ip_address ]] && { echo "Could not find IP address" >&2; exit 1; }
 
-export mac_address="$(ip addr show dev "$nic" | gawk 'match($0, /^\s*link\/ether\s+([0-9A-Fa-f:]+)/, a) { print a[1]; exit }')"
+match_line mac_address '^link/ether[[:space:]]+([0-9A-Fa-f:]+)' <<< "$addr_info"
 [[ -z $mac_address ]] && { echo "Could not find MAC address" >&2; exit 1; }
 
-export dns_server="$(resolvectl dns "$nic" | gawk '$4 ~ /[0-9.]+/ { print $4; exit }')"
+match_line dns_server '\):[[:space:]]*([^[:space:]]+)' < <(resolvectl dns "$nic")
 [[ -z $dns_server ]] && { echo "Could not find DNS server" >&2; exit 1; }
 
+export gateway nic ip_address mac_address dns_server
+
 # Prepare storage devices
 wipefs -a "${root_dev}"
 parted "${root_dev}" --align optimal --script mklabel msdos mkpart primary 0% 100%
@@ -314,10 +502,7 @@ cp /etc/gnupg/dirmngr.conf /mnt/etc/gnupg/dirmngr.conf
 # pacstrap will copy the entire /etc/pacman.d/gnupg directory to the chroot.
 cp /etc/gnupg/dirmngr.conf /etc/pacman.d/gnupg/dirmngr.conf
 # This will be copied to the installed system by pacstrap
-: > /etc/pacman.d/mirrorlist
-for mirror in "${mirrors[@]}"; do
-	echo "Server = ${mirror}" >> /etc/pacman.d/mirrorlist
-done
+printf 'Server = %s\n' "${mirrors[@]}" > /etc/pacman.d/mirrorlist
 
 # For some unknown reason, pacstrap sometimes fails to resolve any hostnames;
 # resolving something beforehand seems to kick something in the stack so that
@@ -441,28 +626,45 @@ ARCHCHROOTEOF
 
 class MiniExpect:
     def __init__(self, args: List[str]) -> None:
+        import pty
+        import select
+        import tty
+
         self.pid, self.master = pty.fork()
         if self.pid == 0:
             os.execvp(args[0], args)
         tty.setraw(self.master)
-        flags = fcntl.fcntl(self.master, fcntl.F_GETFD)
-        fcntl.fcntl(self.master, fcntl.F_SETFD, flags | os.O_NONBLOCK)
+        os.set_blocking(self.master, False)
         self._buf = bytearray()
-        self._sel = selectors.DefaultSelector()
-        self._sel.register(self.master, selectors.EVENT_READ)
-        self._sel.register(sys.stdin, selectors.EVENT_READ)
+        self._poll = select.poll()
+        self._poll.register(self.master, select.POLLIN)
+        self._poll.register(sys.stdin, select.POLLIN)
 
     def __enter__(self) -> "MiniExpect":
+        import termios
+        import tty
+
         self.old_attr = termios.tcgetattr(sys.stdin.fileno())
-        self.old_flags = fcntl.fcntl(sys.stdin.fileno(), fcntl.F_GETFD)
-        fcntl.fcntl(sys.stdin.fileno(), fcntl.F_SETFD, self.old_flags | os.O_NONBLOCK)
         tty.setraw(sys.stdin.fileno())
         return self
 
     def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        import termios
+
         termios.tcsetattr(sys.stdin.fileno(), termios.TCSAFLUSH, self.old_attr)
-        fcntl.fcntl(sys.stdin.fileno(), fcntl.F_SETFD, self.old_flags)
         os.close(self.master)
+        self._reap()
+
+    def _reap(self) -> None:
+        # The child has usually exited by the time we get here. If it hasn't,
+        # give it a chance to exit on its own, then ask it to, then make it.
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            deadline = time.monotonic() + 2
+            while time.monotonic() < deadline:
+                if os.waitpid(self.pid, os.WNOHANG)[0]:
+                    return
+                time.sleep(0.01)
+            os.kill(self.pid, sig)
         os.waitpid(self.pid, 0)
 
     def interact(
@@ -472,20 +674,29 @@ class MiniExpect:
         write: Optional[bytes] = None,
         until_eof: bool = False,
     ) -> None:
+        import select
+
         if write:
             writebuf = bytearray(write)
-            self._sel.modify(self.master, selectors.EVENT_READ | selectors.EVENT_WRITE)
+            self._poll.modify(self.master, select.POLLIN | select.POLLOUT)
         else:
             writebuf = bytearray()
-            self._sel.modify(self.master, selectors.EVENT_READ)
+            self._poll.modify(self.master, select.POLLIN)
+        # Track how much has been written instead of deleting it from the
+        # front of the buffer, which would move the remaining data each time.
+        write_start = 0
         found_expect = not expect
-        while until_eof or writebuf or not found_expect:
-            events = self._sel.select()
-            for key, mask in events:
-                if key.fileobj == self.master:
-                    if mask & selectors.EVENT_READ:
+        search_start = 0
+        while until_eof or write_start < len(writebuf) or not found_expect:
+            for fd, mask in self._poll.poll():
+                if fd == self.master:
+                    # Treat POLLHUP and POLLERR as readable so that we get the
+                    # error from read().
+                    if mask & ~select.POLLOUT:
                         try:
-                            read = os.read(self.master, 4096)
+                            read = os.read(self.master, 128 * 1024)
+                        except BlockingIOError:
+                            read = b""
                         except OSError as e:
                             if e.errno == errno.EIO:
                                 raise EOFError
@@ -494,23 +705,41 @@ class MiniExpect:
                         sys.stdout.buffer.flush()
                         self._buf.extend(read)
                         if not found_expect:
-                            found_expect = expect in self._buf  # type: ignore[operator]
+                            assert expect is not None
+                            found_expect = self._buf.find(expect, search_start) != -1
+                            # Later searches only need to cover new data and
+                            # enough old data to complete a match.
+                            search_start = max(len(self._buf) - len(expect) + 1, 0)
                         if len(self._buf) >= 8192:
+                            search_start = max(search_start - len(self._buf) + 4096, 0)
                             del self._buf[:-4096]
-                    if mask & selectors.EVENT_WRITE:
-                        written = os.write(self.master, writebuf)
-                        del writebuf[:written]
-                        if not writebuf:
-                            self._sel.modify(self.master, selectors.EVENT_READ)
-                else:  # key.fileobj == sys.stdin and mask == selectors.EVENT_READ
-                    read = os.read(sys.stdin.fileno(), 4096)
+                    if mask & select.POLLOUT:
+                        try:
+                            with memoryview(writebuf) as view:
+                                written = os.write(self.master, view[write_start:])
+                        except BlockingIOError:
+                            written = 0
+                        write_start += written
+                        if write_start == len(writebuf):
+                            writebuf.clear()
+                            write_start = 0
+                            self._poll.modify(self.master, select.POLLIN)
+                else:  # fd == sys.stdin.fileno() and mask == select.POLLIN
+                    read = os.read(fd, 128 * 1024)
                     writebuf.extend(read)
-                    self._sel.modify(
-                        self.master, selectors.EVENT_READ | selectors.EVENT_WRITE
-                    )
+                    self._poll.modify(self.master, select.POLLIN | select.POLLOUT)
+
+
+def drive_cache_unsafe(drive: str) -> str:
+    drive, n = _drive_cache_re.subn(r"\1cache=unsafe", drive)
+    if n == 0:
+        drive += ",cache=unsafe"
+    return drive
 
 
 def cmd_archinstall(args: argparse.Namespace, script_config: ScriptConfig) -> None:
+    import tempfile
+
     args.packages = [
         # Base system
         "base",
@@ -543,7 +772,7 @@ def cmd_archinstall(args: argparse.Namespace, script_config: ScriptConfig) -> No
     ]
 
     if not hasattr(args, "hostname"):
-        args.hostname = re.sub(r"[^-a-z0-9]+", "-", args.name.lower()).strip("-")
+        args.hostname = _hostname_invalid_re.sub("-", args.name.lower()).strip("-")
 
     if hasattr(args, "iso"):
         iso = Path(args.iso)
@@ -555,54 +784,85 @@ def cmd_archinstall(args: argparse.Namespace, script_config: ScriptConfig) -> No
 
     proxy_vars = "".join(
         [
-            f"export {name}={os.environ[name]}\r"
+            f"export {name}={os.environ[name]}\n"
             for name in ["http_proxy", "https_proxy", "ftp_proxy"]
             if name in os.environ
         ]
     )
 
-    qemu_args = parse_vm_config(script_config.vms_dir / args.name).qemu_args(
-        extra_args=[
-            "-drive",
-            f"file={iso.resolve()},format=raw,media=cdrom,readonly,if=none,id=cdrom",
-            "-device",
-            "ide-cd,drive=cdrom,bootindex=0",
-            "-no-reboot",
+    # Rather than typing the installation script over the serial console,
+    # share it with the guest over VirtFS.
+    with tempfile.TemporaryDirectory(prefix="vmpy-archinstall-") as installer_dir:
+        installer_path = Path(installer_dir) / "install.sh"
+        installer_path.write_text(install_script(args, proxy_vars))
+        installer_path.chmod(0o755)
+
+        virtfs_opts = [
+            "local",
+            f"path={installer_dir}",
+            "security_model=none",
+            "readonly=on",
+            "mount_tag=installer",
         ]
-    )
-
-    os.chdir(script_config.vms_dir)
-    with MiniExpect(qemu_args) as proc:
-        try:
-            proc.interact(expect=b"Arch Linux install medium")
-            proc.interact(write=b"\t console=ttyS0,115200\r")
-            proc.interact(expect=b"login: ")
-            proc.interact(write=b"root\r")
-            proc.interact(expect=b"# ")
-            # This grmlzsh feature breaks heredocs containing some commands
-            # (like git).
-            proc.interact(write=b"zstyle ':acceptline:default' nocompwarn true\r")
-            # Disable the heredoc> prompt.
-            proc.interact(write=b'OLD_PS2="$PS2"; PS2=\r')
-            proc.interact(write=proxy_vars.encode())
-            proc.interact(write=b'cat > install.sh << "INSTALLSHEOF"\r')
-            proc.interact(
-                write=install_script(args, proxy_vars).replace("\n", "\r").encode()
-            )
-            proc.interact(write=b"INSTALLSHEOF\r")
-            proc.interact(write=b'PS2="$OLDPS2"\r')
-            proc.interact(write=b"chmod +x ./install.sh\r")
-            if not args.edit:
-                proc.interact(write=b"./install.sh && poweroff\r")
-            proc.interact(until_eof=True)
-        except EOFError:
-            pass
-        except Exception as e:
-            os.kill(proc.pid, signal.SIGKILL)
-            raise e
-
+        vm_config = parse_vm_config(script_config.vms_dir / args.name)
+        # If the host crashes during the installation, it has to be redone
+        # anyway, so there's no point in flushing the disk images.
+        qemu_options = list(vm_config.qemu_options)
+        for i in range(1, len(qemu_options)):
+            if qemu_options[i - 1] == "-drive":
+                qemu_options[i] = drive_cache_unsafe(qemu_options[i])
+        vm_config.qemu_options = qemu_options
+        qemu_args = vm_config.qemu_args(
+            extra_args=[
+                "-drive",
+                f"file={iso.resolve()},format=raw,media=cdrom,readonly,if=none,id=cdrom",
+                "-device",
+                "ide-cd,drive=cdrom,bootindex=0",
+                "-virtfs",
+                ",".join(virtfs_opts),
+                # The installation is mostly serial, so don't pay for bringing
+                # up the other CPUs. This overrides the VM's -smp option.
+                "-smp",
+                "1",
+                # We never boot from the network, so don't load the PXE ROM.
+                "-global",
+                "virtio-net-pci.romfile=",
+                "-no-reboot",
+            ]
+        )
 
-def main() -> None:
+        os.chdir(script_config.vms_dir)
+        with MiniExpect(qemu_args) as proc:
+            try:
+                proc.interact(expect=b"Arch Linux install medium")
+                proc.interact(write=b"\t console=ttyS0,115200\r")
+                proc.interact(expect=b"login: ")
+                proc.interact(write=b"root\r")
+                proc.interact(expect=b"# ")
+                # The shell reads one line at a time, so send all of the
+                # commands at once.
+                commands = [
+                    proxy_vars.replace("\n", "\r").encode(),
+                    # Copy the script out of the read-only share so that it
+                    # can be edited in the VM.
+                    b"mkdir -p /run/installer && "
+                    b"mount -t 9p -o trans=virtio installer /run/installer && "
+                    b"cp /run/installer/install.sh ./install.sh && "
+                    b"umount /run/installer\r",
+                ]
+                if not args.edit:
+                    commands.append(b"./install.sh && poweroff\r")
+                proc.interact(write=b"".join(commands))
+                proc.interact(until_eof=True)
+            except EOFError:
+                pass
+            except Exception as e:
+                os.kill(proc.pid, signal.SIGKILL)
+                raise e
+
+
+@functools.lru_cache(maxsize=1)
+def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Manage QEMU virtual machines")
 
     subparsers = parser.add_subparsers(
@@ -648,7 +908,6 @@ def main() -> None:
     parser_run.add_argument(
         "-k",
         "--kernel",
-        default=argparse.SUPPRESS,
         help="directory containing kernel build to run; "
         "either a directory in the builds directory, "
         "an absolute path, "
@@ -658,14 +917,12 @@ def main() -> None:
         "-i",
         "--initrd",
         metavar="FILE",
-        default=argparse.SUPPRESS,
         help="file to use as initial ramdisk (only when passing -k)",
     )
     parser_run.add_argument(
         "-a",
         "--append",
         action="append",
-        default=argparse.SUPPRESS,
         help="append a kernel command line argument (only when passing -k)",
     )
     parser_run.add_argument(
@@ -746,7 +1003,11 @@ def main() -> None:
     )
     parser_archinstall.set_defaults(func=cmd_archinstall)
 
-    args = parser.parse_args()
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
     args.func(args, get_script_config())
 
 
@@ -7,6 +7,7 @@ Test block layer scalability
 """
 
 import argparse
+import concurrent.futures
 import datetime
 import glob
 import json
@@ -14,17 +15,16 @@ import multiprocessing
 import os
 import os.path
 import re
-import statistics
 import subprocess
 import sys
 
+import numpy
+
 
 def run_fio(args, num_jobs):
     name = 'fio{}'.format(num_jobs)
-    output = name + '.json'
     fio_cmd = [
         'fio',
-        '--output={}'.format(output),
         '--output-format=json',
         '--name={}'.format(name),
         '--filename={}'.format(args.dev),
@@ -38,23 +38,31 @@ def run_fio(args, num_jobs):
         '--rw={}'.format(args.rw),
         '--unified_rw_reporting=1',
     ]
-    subprocess.check_call(fio_cmd, stdout=subprocess.DEVNULL)
+    fio = subprocess.run(fio_cmd, stdout=subprocess.PIPE, check=True)
+    # Save the output for --parse, but use the copy we already have in memory
+    # rather than reading it back.
+    with open(name + '.json', 'wb') as f:
+        f.write(fio.stdout)
+    return aggregate_iops(json.loads(fio.stdout))
+
 
-    with open(output, 'r') as f:
+def parse_result(path):
+    with open(path, 'r') as f:
         fio_output = json.load(f)
     return aggregate_iops(fio_output)
 
 
 def aggregate_iops(fio_output):
-    iops = [job['mixed']['iops'] for job in fio_output['jobs']]
+    iops = numpy.fromiter((job['mixed']['iops'] for job in fio_output['jobs']),
+                          dtype=numpy.float64, count=len(fio_output['jobs']))
     merges = sum(disk_util['read_merges'] + disk_util['write_merges'] for disk_util in fio_output['disk_util'])
     return {
-            'num_jobs': len(fio_output['jobs']),
-            'total_iops': sum(iops),
-            'min_iops': min(iops),
-            'max_iops': max(iops),
-            'mean_iops': statistics.mean(iops),
-            'iops_stdev': statistics.stdev(iops) if len(iops) > 1 else 0.0,
+            'num_jobs': len(iops),
+            'total_iops': float(iops.sum()),
+            'min_iops': float(iops.min()),
+            'max_iops': float(iops.max()),
+            'mean_iops': float(iops.mean()),
+            'iops_stdev': float(iops.std(ddof=1)) if len(iops) > 1 else 0.0,
             'merges': merges,
     }
 
@@ -107,11 +115,10 @@ def main():
         print_header()
         paths = glob.glob('fio*.json')
         paths.sort(key=lambda path: int(re.search(r'\d+', path).group()))
-        for path in paths:
-            with open(path, 'r') as f:
-                fio_output = json.load(f)
-            iops = aggregate_iops(fio_output)
-            print_results(iops)
+        # The fio output for many jobs can be big, so parse it in parallel.
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            for iops in executor.map(parse_result, paths):
+                print_results(iops)
         return
 
     if args.dev is None:
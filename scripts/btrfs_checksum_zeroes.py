@@ -15,19 +15,40 @@ for i in range(256):
         _crc32c_table[i] = fwd & 0xFFFFFFFF
 
 
+# Appending zero bytes to a CRC is a linear operation on the CRC state, so it
+# can be represented as a 32x32 matrix over GF(2). Each matrix is stored as a
+# list of columns.
+def gf2_matrix_times(mat, vec):
+    result = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            result ^= mat[i]
+        vec >>= 1
+        i += 1
+    return result
+
+
+def gf2_matrix_square(mat):
+    return [gf2_matrix_times(mat, col) for col in mat]
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="calculate the Btrfs CRC32C of zero byte blocks of different sizes"
     )
     args = parser.parse_args()
 
-    crc = 0xFFFFFFFF
+    # Operator for appending one zero byte.
+    op = [(1 << n >> 8) ^ _crc32c_table[(1 << n) & 0xFF] for n in range(32)]
+    crc = gf2_matrix_times(op, 0xFFFFFFFF)
     i = 1
     while True:
-        crc = (crc >> 8) ^ _crc32c_table[crc & 0xFF]
-        if i & (i - 1) == 0:
-            print(f"{i} 0x{crc ^ 0xFFFFFFFF:08x}", flush=True)
-        i += 1
+        print(f"{i} 0x{crc ^ 0xFFFFFFFF:08x}", flush=True)
+        # Append i more zero bytes, then double the operator for next time.
+        crc = gf2_matrix_times(op, crc)
+        op = gf2_matrix_square(op)
+        i *= 2
 
 
 if __name__ == "__main__":
@@ -87,6 +87,40 @@ class AttrType(IntEnum):
     CLONE_LEN = 24
 
 
+# For converting raw types to enums without raising exceptions for unknown
+# types.
+_CMD_TYPES = {cmd.value: cmd for cmd in CmdType}
+_ATTR_TYPES = {attr.value: attr for attr in AttrType}
+
+_INT_ATTRS = frozenset(
+    {
+        AttrType.CTRANSID,
+        AttrType.INO,
+        AttrType.SIZE,
+        AttrType.MODE,
+        AttrType.UID,
+        AttrType.GID,
+        AttrType.FILE_OFFSET,
+        AttrType.CLONE_CTRANSID,
+        AttrType.CLONE_OFFSET,
+        AttrType.CLONE_LEN,
+    }
+)
+_TIMESTAMP_ATTRS = frozenset(
+    {AttrType.CTIME, AttrType.MTIME, AttrType.ATIME, AttrType.OTIME}
+)
+_STRING_ATTRS = frozenset(
+    {
+        AttrType.XATTR_NAME,
+        AttrType.PATH,
+        AttrType.PATH_TO,
+        AttrType.PATH_LINK,
+        AttrType.CLONE_PATH,
+    }
+)
+_UUID_ATTRS = frozenset({AttrType.UUID, AttrType.CLONE_UUID})
+
+
 @dataclass
 class DevT:
     major: int
@@ -122,13 +156,17 @@ def parse_send_stream(file: BinaryIO, check_crcs: bool) -> Iterator[Cmd]:
     if version != BTRFS_SEND_STREAM_VERSION:
         raise ValueError(f"expected version {BTRFS_SEND_STREAM_VERSION}, got {version}")
 
+    buf = bytearray()
     while True:
         cmd_len, cmd, crc = struct.unpack("<IHI", file.read(10))
-        try:
-            cmd = CmdType(cmd)
-        except ValueError:
-            pass
-        data = file.read(cmd_len)
+        cmd = _CMD_TYPES.get(cmd, cmd)
+        # Read the command into a reused buffer. Attributes that we return as
+        # bytes are copied out of it; integers are decoded in place.
+        if len(buf) < cmd_len:
+            buf = bytearray(cmd_len)
+        data = memoryview(buf)[:cmd_len]
+        if file.readinto(data) != cmd_len:
+            raise ValueError("send stream is truncated")
         if check_crcs:
             computed_crc = crc32c(crc32c(0, struct.pack("<IHI", cmd_len, cmd, 0)), data)
             if computed_crc != crc:
@@ -138,40 +176,24 @@ def parse_send_stream(file: BinaryIO, check_crcs: bool) -> Iterator[Cmd]:
         attrs = []
         n = 0
         while n < cmd_len:
-            attr_type, attr_len = struct.unpack("<HH", data[n : n + 4])
+            attr_type, attr_len = struct.unpack_from("<HH", data, n)
             n += 4
-            try:
-                attr_type = AttrType(attr_type)
-            except ValueError:
-                pass
-            attr_value: Any = data[n : n + attr_len]
+            attr_type = _ATTR_TYPES.get(attr_type, attr_type)
+            raw_value = data[n : n + attr_len]
             n += attr_len
 
-            if attr_type in {
-                AttrType.CTRANSID,
-                AttrType.INO,
-                AttrType.SIZE,
-                AttrType.MODE,
-                AttrType.UID,
-                AttrType.GID,
-                AttrType.FILE_OFFSET,
-                AttrType.CLONE_CTRANSID,
-                AttrType.CLONE_OFFSET,
-                AttrType.CLONE_LEN,
-            }:
-                attr_value = int.from_bytes(attr_value, "little")
+            attr_value: Any
+            if attr_type in _INT_ATTRS:
+                attr_value = int.from_bytes(raw_value, "little")
             elif attr_type == AttrType.RDEV:
-                dev = int.from_bytes(attr_value, "little")
+                dev = int.from_bytes(raw_value, "little")
                 attr_value = DevT(
                     (dev & 0xFFF00) >> 8, (dev & 0xFF) | ((dev >> 12) & 0xFFF00),
                 )
-            elif attr_type in {
-                AttrType.CTIME,
-                AttrType.MTIME,
-                AttrType.ATIME,
-                AttrType.OTIME,
-            }:
-                attr_value = Timestamp(*struct.unpack("<QI", attr_value))
+            elif attr_type in _TIMESTAMP_ATTRS:
+                attr_value = Timestamp(*struct.unpack("<QI", raw_value))
+            else:
+                attr_value = bytes(raw_value)
 
             attrs.append(Attr(attr_type, attr_value))
         yield Cmd(cmd, attrs, crc)
@@ -214,15 +236,9 @@ def main() -> None:
             else:
                 print(f"  Unknown attribute {attr.type}", end=" ")
             if isinstance(attr.value, bytes):
-                if attr.type in {
-                    AttrType.XATTR_NAME,
-                    AttrType.PATH,
-                    AttrType.PATH_TO,
-                    AttrType.PATH_LINK,
-                    AttrType.CLONE_PATH,
-                }:
+                if attr.type in _STRING_ATTRS:
                     print(repr(attr.value)[1:])
-                elif attr.type in {AttrType.UUID, AttrType.CLONE_UUID}:
+                elif attr.type in _UUID_ATTRS:
                     print(uuid.UUID(bytes=attr.value))
                 else:
                     print(
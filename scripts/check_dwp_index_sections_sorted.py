@@ -3,10 +3,10 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
-from array import array
 import sys
 
 from elftools.elf.elffile import ELFFile
+import numpy
 
 
 def main() -> None:
@@ -59,40 +59,38 @@ def main() -> None:
             if len(data) < section_size_table_end:
                 sys.exit("error: section is truncated")
 
-            section_offset_table = array("I")
-            section_offset_table.frombytes(
-                view[section_offset_table_start:section_offset_table_end]
-            )
-            section_size_table = array("I")
-            section_size_table.frombytes(
-                view[section_size_table_start:section_size_table_end]
-            )
-            if byteorder != sys.byteorder:
-                section_offset_table.byteswap()
-                section_size_table.byteswap()
-
-            last_offset = array("I", [0] * section_count)
-            for i in range(unit_count):
-                for j in range(section_count):
-                    if section_size_table[i * section_count + j] == 0:
-                        continue
-                    offset = section_offset_table[i * section_count + j]
-                    if offset < last_offset[j]:
-                        if (
-                            i > 0
-                            and offset + 0x100000000
-                            == section_offset_table[(i - 1) * section_count + j]
-                            + section_size_table[(i - 1) * section_count + j]
-                        ):
-                            print(
-                                f"{section_name} unit {i + 1} section {j} overflowed 32-bit offset",
-                                file=sys.stderr,
-                            )
-                        else:
-                            sys.exit(
-                                f"{section_name} unit {i + 1} section {j} not sorted ({hex(offset)} < {hex(last_offset[j])})"
-                            )
-                    last_offset[j] = offset
+            dtype = numpy.dtype("<u4" if elf.little_endian else ">u4")
+            section_offset_table = numpy.frombuffer(
+                view[section_offset_table_start:section_offset_table_end], dtype
+            ).reshape(unit_count, section_count)
+            section_size_table = numpy.frombuffer(
+                view[section_size_table_start:section_size_table_end], dtype
+            ).reshape(unit_count, section_count)
+
+            # Find the units where each section's offset is less than the
+            # offset of the previous unit that has that section, then report
+            # them in order.
+            unsorted = []
+            for j in range(section_count):
+                units = numpy.flatnonzero(section_size_table[:, j])
+                offsets = section_offset_table[units, j]
+                for k in numpy.flatnonzero(offsets[1:] < offsets[:-1]):
+                    unsorted.append((int(units[k + 1]), j, int(offsets[k])))
+            unsorted.sort()
+
+            for i, j, last_offset in unsorted:
+                offset = int(section_offset_table[i, j])
+                if i > 0 and offset + 0x100000000 == int(
+                    section_offset_table[i - 1, j]
+                ) + int(section_size_table[i - 1, j]):
+                    print(
+                        f"{section_name} unit {i + 1} section {j} overflowed 32-bit offset",
+                        file=sys.stderr,
+                    )
+                else:
+                    sys.exit(
+                        f"{section_name} unit {i + 1} section {j} not sorted ({hex(offset)} < {hex(last_offset)})"
+                    )
 
     print("Sorted")
 
@@ -0,0 +1,95 @@
+// SPDX-FileCopyrightText: Omar Sandoval <osandov@osandov.com>
+// SPDX-License-Identifier: MIT
+
+// Shared library implementing the Btrfs CRC32C for Python scripts to load
+// with ctypes when libbtrfs isn't available. Like libbtrfs's crc32c_le(), this
+// doesn't invert the CRC before or after.
+
+#include <stddef.h>
+#include <stdint.h>
+#include <string.h>
+
+static uint32_t crc32c_table[256];
+
+static uint32_t crc32c_sw(uint32_t crc, const unsigned char *p, size_t len)
+{
+	while (len--)
+		crc = (crc >> 8) ^ crc32c_table[(crc ^ *p++) & 0xff];
+	return crc;
+}
+
+#if defined(__x86_64__)
+#include <nmmintrin.h>
+
+__attribute__((target("sse4.2")))
+static uint32_t crc32c_hw(uint32_t crc, const unsigned char *p, size_t len)
+{
+	uint64_t crc64 = crc;
+	while (len >= 8) {
+		uint64_t x;
+		memcpy(&x, p, sizeof(x));
+		crc64 = _mm_crc32_u64(crc64, x);
+		p += 8;
+		len -= 8;
+	}
+	crc = crc64;
+	while (len--)
+		crc = _mm_crc32_u8(crc, *p++);
+	return crc;
+}
+
+static int have_crc32c_hw(void)
+{
+	return __builtin_cpu_supports("sse4.2");
+}
+#elif defined(__aarch64__)
+#include <arm_acle.h>
+#include <sys/auxv.h>
+#include <asm/hwcap.h>
+
+__attribute__((target("+crc")))
+static uint32_t crc32c_hw(uint32_t crc, const unsigned char *p, size_t len)
+{
+	while (len >= 8) {
+		uint64_t x;
+		memcpy(&x, p, sizeof(x));
+		crc = __crc32cd(crc, x);
+		p += 8;
+		len -= 8;
+	}
+	while (len--)
+		crc = __crc32cb(crc, *p++);
+	return crc;
+}
+
+static int have_crc32c_hw(void)
+{
+	return getauxval(AT_HWCAP) & HWCAP_CRC32;
+}
+#else
+#define crc32c_hw crc32c_sw
+
+static int have_crc32c_hw(void)
+{
+	return 0;
+}
+#endif
+
+static uint32_t (*crc32c_impl)(uint32_t, const unsigned char *, size_t);
+
+__attribute__((constructor))
+static void crc32c_init(void)
+{
+	for (uint32_t i = 0; i < 256; i++) {
+		uint32_t crc = i;
+		for (int j = 0; j < 8; j++)
+			crc = (crc >> 1) ^ (crc & 1 ? 0x82f63b78 : 0);
+		crc32c_table[i] = crc;
+	}
+	crc32c_impl = have_crc32c_hw() ? crc32c_hw : crc32c_sw;
+}
+
+uint32_t crc32c(uint32_t crc, const void *buf, size_t len)
+{
+	return crc32c_impl(crc, buf, len);
+}
@@ -3,6 +3,8 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import concurrent.futures
+import errno
 import itertools
 import os
 import re
@@ -35,11 +37,6 @@ SYMLINKS = [
 ]
 
 
-def subprocess_wait_check(proc):
-    if proc.wait() != 0:
-        raise subprocess.CalledProcessError(proc.returncode, proc.args)
-
-
 def make_fs_hierarchy():
     for dir in DIRS:
         os.mkdir(dir)
@@ -47,38 +44,66 @@ def make_fs_hierarchy():
         os.symlink(target, link_name)
 
 
+# Like shutil.copy(), but try copy_file_range() first, which lets the
+# filesystem reflink the file or at least copy it without going through
+# userspace.
+def copy_file(src, dst_dir):
+    dst = os.path.join(dst_dir, os.path.basename(src))
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            while True:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30)
+                if not n:
+                    break
+                copied += n
+        # Some filesystems return 0 from copy_file_range() without copying
+        # anything.
+        complete = copied >= size
+    except OSError as e:
+        if e.errno not in {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}:
+            raise
+        complete = False
+    if not complete:
+        shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+
+
 def install_binary(name):
     binary_path = shutil.which(name)
 
+    ldd = subprocess.run(['ldd', binary_path], stdout=subprocess.PIPE)
+    lines = ldd.stdout.splitlines()
+    if any(line.strip() in {b'not a dynamic executable', b'statically linked'}
+           for line in lines):
+        copy_file(binary_path, 'usr/bin')
+        return
+    ldd.check_returncode()
+
+    # ldd prints the same libraries as the loader's --list option, so we don't
+    # need to run the loader separately.
     loader = None
-    ldd = subprocess.Popen(['ldd', binary_path], stdout=subprocess.PIPE)
-    dynamic = True
-    for line in ldd.stdout:
-        if line.strip() == b'not a dynamic executable':
-            dynamic = False
-        # The only absolute path printed by ldd is the loader.
+    libraries = []
+    for line in lines:
+        # The only absolute path printed at the start of a line is the loader.
         match = re.match(rb'\s*(/\S+)', line)
         if match:
             loader = match.group(1).decode('ascii')
-    if dynamic:
-        subprocess_wait_check(ldd)
-        assert loader is not None
-    else:
-        ldd.wait()
-        shutil.copy(binary_path, 'usr/bin')
-        return
-
-    libraries = [loader]
-    ld_so = subprocess.Popen([loader, '--list', binary_path], stdout=subprocess.PIPE)
-    for line in ld_so.stdout:
+            continue
         match = re.match(rb'\s*\S+ => (\S+)', line)
         if match:
             libraries.append(match.group(1).decode('ascii'))
-    subprocess_wait_check(ld_so)
+    assert loader is not None
+    libraries.insert(0, loader)
 
-    shutil.copy(binary_path, 'usr/bin')
-    for library_path in libraries:
-        shutil.copy(library_path, 'usr/lib')
+    # The copies are independent, so do them in parallel.
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = [executor.submit(copy_file, binary_path, 'usr/bin')]
+        for library_path in libraries:
+            futures.append(executor.submit(copy_file, library_path, 'usr/lib'))
+        for future in futures:
+            future.result()
 
 
 def install_busybox():
@@ -86,16 +111,14 @@ def install_busybox():
     # We can't use busybox --install -s because it creates absolute symlinks,
     # and we can't use busybox --install because cpio doesn't preserve
     # hardlinks.
-    proc = subprocess.Popen(['usr/bin/busybox', '--list'], stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        applet = line.strip().decode('ascii')
-        try:
+    applets = subprocess.run(['usr/bin/busybox', '--list'],
+                             stdout=subprocess.PIPE, check=True).stdout
+    # The user may have explicitly installed a binary with the same name as an
+    # applet.
+    existing = set(os.listdir('usr/bin'))
+    for applet in applets.decode('ascii').split():
+        if applet not in existing:
             os.symlink('busybox', os.path.join('usr/bin', applet))
-        except FileExistsError:
-            # The user may have explicitly installed a binary with the same
-            # name.
-            pass
-    subprocess_wait_check(proc)
 
 
 def install_init():
@@ -147,7 +170,9 @@ def main():
     if args.initramfs:
         install_init()
         with open(args.path, 'xb') as f:
-            cmd = 'find . -print0 | cpio --quiet --format=newc --create --null | gzip'
+            # pigz is a drop-in parallel replacement for gzip.
+            gzip = 'pigz' if shutil.which('pigz') else 'gzip'
+            cmd = 'find . -print0 | cpio --quiet --format=newc --create --null | ' + gzip
             subprocess.run(cmd, stdout=f, shell=True, check=True)
         tempdir.cleanup()
 
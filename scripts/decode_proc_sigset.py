@@ -6,6 +6,9 @@ import argparse
 import signal
 
 
+SIGNAL_NAMES = {sig.value: sig.name for sig in signal.Signals}
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='decode a signal set in /proc/status')
@@ -13,15 +16,12 @@ def main():
     args = parser.parse_args()
 
     value = int(args.value, base=16)
-    i = 1
+    # Only visit the set bits: value & -value isolates the lowest one.
     while value:
-        if value & 1:
-            try:
-                print(signal.Signals(i).name)
-            except ValueError:
-                print(i)
-        value >>= 1
-        i += 1
+        lowest = value & -value
+        i = lowest.bit_length()
+        print(SIGNAL_NAMES.get(i, i))
+        value ^= lowest
 
 if __name__ == '__main__':
     main()
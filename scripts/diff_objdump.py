@@ -4,12 +4,10 @@
 
 import argparse
 import difflib
-import re
+import hashlib
 import subprocess
 import sys
 
-symbol_re = re.compile(r"^<([^>]+)>:")
-
 
 def read_to_next_symbol(f):
     lines = []
@@ -17,11 +15,22 @@ def read_to_next_symbol(f):
         line = f.readline()
         if not line:
             return lines, None
-        match = symbol_re.match(line)
-        if match:
-            return lines, match.group(1)
-        else:
-            lines.append(line)
+        # Symbol lines look like "<name>:". This is checked for every line, so
+        # avoid a regular expression.
+        if line.startswith("<"):
+            end = line.find(">")
+            if end > 1 and line.startswith(":", end + 1):
+                return lines, line[1:end]
+        lines.append(line)
+
+
+# Symbols that we haven't matched yet may need to be kept around until the end,
+# so unless we need to print a diff, only keep a hash of their disassembly.
+def fingerprint(lines):
+    hasher = hashlib.blake2b(digest_size=16)
+    for line in lines:
+        hasher.update(line.encode())
+    return hasher.digest()
 
 
 def main():
@@ -52,6 +61,8 @@ def main():
                     difflib.unified_diff(lines1, lines2, args.file1, args.file2)
                 )
 
+    save_lines = (lambda lines: lines) if args.diff else fingerprint
+
     objdump_command = [
         "objdump",
         "--disassemble",
@@ -82,13 +93,17 @@ def main():
                 print_symbol_diff(symbol1, lines1, lines2)
             else:
                 if symbol1 in unmatched2:
-                    print_symbol_diff(symbol1, lines1, unmatched2.pop(symbol1))
+                    print_symbol_diff(
+                        symbol1, save_lines(lines1), unmatched2.pop(symbol1)
+                    )
                 elif symbol1 is not None:
-                    unmatched1[symbol1] = lines1
+                    unmatched1[symbol1] = save_lines(lines1)
                 if symbol2 in unmatched1:
-                    print_symbol_diff(symbol2, unmatched1.pop(symbol2), lines2)
+                    print_symbol_diff(
+                        symbol2, unmatched1.pop(symbol2), save_lines(lines2)
+                    )
                 elif symbol2 is not None:
-                    unmatched1[symbol2] = lines2
+                    unmatched2[symbol2] = save_lines(lines2)
 
             symbol1 = next_symbol1
             symbol2 = next_symbol2
@@ -3,8 +3,11 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
-from typing import Any, Optional
+import mmap
+import struct
+from typing import Any, Optional, Union
 
+from elftools.elf.constants import SH_FLAGS
 from elftools.elf.elffile import ELFFile
 from elftools.elf.sections import Section
 
@@ -13,62 +16,104 @@ class FormatError(Exception):
     pass
 
 
+# Reader for a section. The data may be the section contents or the whole file
+# (e.g., mmapped) with the section at the given start and size. Offsets are
+# relative to the start of the section.
 class Reader:
-    def __init__(self, data: bytes, little_endian: bool) -> None:
+    def __init__(
+        self,
+        data: Union[bytes, mmap.mmap],
+        little_endian: bool,
+        start: int = 0,
+        size: Optional[int] = None,
+    ) -> None:
         self._data = data
         self._byteorder: Any = "little" if little_endian else "big"
+        # struct is much faster than int.from_bytes() for the common sizes.
+        prefix = "<" if little_endian else ">"
+        self._unpack_uint = {
+            size: struct.Struct(prefix + code).unpack_from
+            for size, code in ((2, "H"), (4, "I"), (8, "Q"))
+        }
+        self._start = start
+        self._size = len(data) - start if size is None else size
         self.offset = 0
 
     def _seek(self, offset: Optional[int]) -> None:
         if offset is not None:
-            if offset > len(self._data):
+            if offset > self._size:
                 raise FormatError("out of bounds")
             self.offset = offset
 
     def read_uint(self, size: int, offset: Optional[int] = None) -> int:
         self._seek(offset)
-        if len(self._data) - self.offset < size:
+        if self._size - self.offset < size:
             raise FormatError("truncated")
-        value = int.from_bytes(
-            self._data[self.offset : self.offset + size], self._byteorder
-        )
+        pos = self._start + self.offset
+        unpack = self._unpack_uint.get(size)
+        if unpack is None:
+            value = int.from_bytes(self._data[pos : pos + size], self._byteorder)
+        else:
+            value = unpack(self._data, pos)[0]
         self.offset += size
         return value
 
     def read_ubyte(self, offset: Optional[int] = None) -> int:
         self._seek(offset)
-        if self.offset >= len(self._data):
+        if self.offset >= self._size:
             raise FormatError("truncated")
-        value = self._data[self.offset]
+        value = self._data[self._start + self.offset]
         self.offset += 1
         return value
 
     def read_uleb128(self, offset: Optional[int] = None) -> int:
         self._seek(offset)
-        value = 0
-        shift = 0
-        while True:
-            byte = self.read_ubyte()
+        data = self._data
+        pos = self._start + self.offset
+        end = self._start + self._size
+        # Fast path for the common case of a single byte.
+        if pos >= end:
+            raise FormatError("truncated")
+        byte = data[pos]
+        pos += 1
+        value = byte & 0x7F
+        shift = 7
+        while byte & 0x80:
+            if pos >= end:
+                raise FormatError("truncated")
+            byte = data[pos]
+            pos += 1
             value |= (byte & 0x7F) << shift
-            if (byte & 0x80) == 0:
-                return value
             shift += 7
+        self.offset = pos - self._start
+        return value
 
     def read_string(self, offset: Optional[int] = None) -> str:
         self._seek(offset)
-        end = self._data.index(b"\0", self.offset)
-        s = self._data[self.offset : end]
-        self.offset = end + 1
+        start = self._start + self.offset
+        end = self._data.find(b"\0", start, self._start + self._size)
+        if end < 0:
+            raise FormatError("unterminated string")
+        s = self._data[start:end]
+        self.offset = end + 1 - self._start
         return s.decode()
 
     def eof(self) -> bool:
-        return self.offset >= len(self._data)
+        return self.offset >= self._size
 
 
-def dump_debug_macinfo(elf: ELFFile, macinfo_scn: Section) -> None:
+def section_reader(mm: mmap.mmap, scn: Section, little_endian: bool) -> Reader:
+    # Read the section directly from the mapped file unless pyelftools needs to
+    # decompress it.
+    if scn["sh_flags"] & SH_FLAGS.SHF_COMPRESSED or scn["sh_type"] == "SHT_NOBITS":
+        return Reader(scn.data(), little_endian)
+    return Reader(mm, little_endian, scn["sh_offset"], scn["sh_size"])
+
+
+def dump_debug_macinfo(elf: ELFFile, mm: mmap.mmap, macinfo_scn: Section) -> None:
     print(f"Section {macinfo_scn.name} @ {hex(macinfo_scn['sh_offset'])}")
 
-    macinfo_reader = Reader(macinfo_scn.data(), elf.little_endian)
+    macinfo_reader = section_reader(mm, macinfo_scn, elf.little_endian)
 
     while not macinfo_reader.eof():
         print("  Macro Unit @", hex(macinfo_reader.offset))
@@ -96,7 +141,7 @@ def dump_debug_macinfo(elf: ELFFile, macinfo_scn: Section) -> None:
                 raise FormatError(f"unknown opcode {hex(opcode)}")
 
 
-def dump_debug_macro(elf: ELFFile, macro_scn: Section) -> None:
+def dump_debug_macro(elf: ELFFile, mm: mmap.mmap, macro_scn: Section) -> None:
     print(f"Section {macro_scn.name} @ {hex(macro_scn['sh_offset'])}")
 
     if macro_scn.name.endswith(".dwo"):
@@ -112,10 +157,12 @@ def dump_debug_macro(elf: ELFFile, macro_scn: Section) -> None:
         str_scn = elf.get_section_by_name(".debug_str")
         str_offsets_scn = elf.get_section_by_name(".debug_str_offsets")
         dwarf_type = "plain"
-    macro_reader = Reader(macro_scn.data(), elf.little_endian)
-    str_reader = Reader(str_scn.data(), elf.little_endian) if str_scn else None
+    macro_reader = section_reader(mm, macro_scn, elf.little_endian)
+    str_reader = section_reader(mm, str_scn, elf.little_endian) if str_scn else None
     str_offsets_reader = (
-        Reader(str_offsets_scn.data(), elf.little_endian) if str_offsets_scn else None
+        section_reader(mm, str_offsets_scn, elf.little_endian)
+        if str_offsets_scn
+        else None
     )
 
     while not macro_reader.eof():
@@ -175,19 +222,18 @@ def dump_debug_macro(elf: ELFFile, macro_scn: Section) -> None:
             elif opcode == 5 or opcode == 6:
                 lineno = macro_reader.read_uleb128()
                 strp = macro_reader.read_uint(offset_size)
-                print(
-                    "define_strp" if opcode == 5 else "undef_strp",
-                    f"line {lineno}, strp {strp} ",
-                    end="",
-                )
                 try:
                     if str_reader:
-                        string = str_reader.read_string(strp)
+                        string = f"-> {str_reader.read_string(strp)}"
                     else:
                         raise FormatError("no .debug_str")
-                    print("->", string)
                 except FormatError as e:
-                    print(f"<{e}>")
+                    string = f"<{e}>"
+                print(
+                    "define_strp" if opcode == 5 else "undef_strp",
+                    f"line {lineno}, strp {strp}",
+                    string,
+                )
             elif opcode == 7:
                 print("import", hex(macro_reader.read_uint(offset_size)))
             elif opcode == 8 or opcode == 9:
@@ -202,11 +248,11 @@ def dump_debug_macro(elf: ELFFile, macro_scn: Section) -> None:
             elif opcode == 11 or opcode == 12:
                 lineno = macro_reader.read_uleb128()
                 strx = macro_reader.read_uleb128()
-                print(
-                    "define_strx" if opcode == 11 else "undef_strx",
+                # Build the whole line so that it only takes one print().
+                line = [
+                    "define_strx " if opcode == 11 else "undef_strx ",
                     f"line {lineno}, strx {strx} ",
-                    end="",
-                )
+                ]
                 if dwarf_type == "dwo":
                     # It's harder to get the str_offsets_base for normal and
                     # dwp files.
@@ -218,16 +264,14 @@ def dump_debug_macro(elf: ELFFile, macro_scn: Section) -> None:
                             )
                         else:
                             raise FormatError("no .debug_str_offsets")
-                        print("-> strp", hex(strp), end=" ")
+                        line.append(f"-> strp {hex(strp)} ")
                         if str_reader:
-                            string = str_reader.read_string(strp)
+                            line.append(f"-> {str_reader.read_string(strp)}")
                         else:
                             raise FormatError("no .debug_str")
-                        print("->", string)
                     except FormatError as e:
-                        print(f"<{e}>")
-                else:
-                    print()
+                        line.append(f"<{e}>")
+                print(*line, sep="")
             else:
                 raise FormatError(f"unknown opcode {hex(opcode)}")
 
@@ -239,7 +283,9 @@ def main() -> None:
     parser.add_argument("path")
     args = parser.parse_args()
 
-    with open(args.path, "rb") as f:
+    with open(args.path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, prot=mmap.PROT_READ
+    ) as mm:
         elf = ELFFile(f)
 
         for section in elf.iter_sections():
@@ -248,11 +294,11 @@ def main() -> None:
                     section.name == ".debug_macinfo"
                     or section.name == ".debug_macinfo.dwo"
                 ):
-                    dump_debug_macinfo(elf, section)
+                    dump_debug_macinfo(elf, mm, section)
                 elif (
                     section.name == ".debug_macro" or section.name == ".debug_macro.dwo"
                 ):
-                    dump_debug_macro(elf, section)
+                    dump_debug_macro(elf, mm, section)
             except FormatError as e:
                 print(f"<{e}>")
 
@@ -3,10 +3,12 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
-from array import array
+import mmap
 import sys
 
+from elftools.elf.constants import SH_FLAGS
 from elftools.elf.elffile import ELFFile
+import numpy
 
 DW_SECT = {
     2: {
@@ -31,6 +33,47 @@ DW_SECT = {
 }
 
 
+_HEX_PAIRS = numpy.array([list(b"%02x" % i) for i in range(256)], dtype=numpy.uint8)
+
+
+# Format an array of 32-bit values as 8 hexadecimal digits each. Returns an
+# array of ASCII characters with an extra dimension of length 8.
+def hex_digits(values: numpy.ndarray) -> numpy.ndarray:
+    big_endian_bytes = values.astype(">u4").view(numpy.uint8)
+    return _HEX_PAIRS[big_endian_bytes].reshape(values.shape + (8,))
+
+
+# Format an array of values as right-aligned decimal numbers in the given
+# width. Returns an array of ASCII characters with an extra dimension of length
+# width.
+def decimal_digits(values: numpy.ndarray, width: int) -> numpy.ndarray:
+    powers = 10 ** numpy.arange(width - 1, -1, -1, dtype=numpy.uint64)
+    values = values.astype(numpy.uint64)[..., None]
+    digits = (values // powers % 10 + ord("0")).astype(numpy.uint8)
+    leading = values < powers
+    leading[..., -1] = False
+    digits[leading] = ord(" ")
+    return digits
+
+
+# Format the rows of the section table. Every row has the same width, so build
+# it as one array of characters rather than formatting each cell in Python.
+def format_section_table(offsets: numpy.ndarray, sizes: numpy.ndarray) -> str:
+    unit_count, section_count = offsets.shape
+    table = numpy.empty((unit_count, 13 + 22 * section_count + 1), dtype=numpy.uint8)
+    table[:, :2] = ord(" ")
+    table[:, 2:12] = decimal_digits(numpy.arange(1, unit_count + 1), 10)
+    table[:, 12] = ord(" ")
+    cells = table[:, 13:-1].reshape(unit_count, section_count, 22)
+    cells[:, :, :2] = numpy.frombuffer(b"0x", dtype=numpy.uint8)
+    cells[:, :, 2:10] = hex_digits(offsets)
+    cells[:, :, 10:13] = numpy.frombuffer(b"+0x", dtype=numpy.uint8)
+    cells[:, :, 13:21] = hex_digits(sizes)
+    cells[:, :, 21] = ord(" ")
+    table[:, -1] = ord("\n")
+    return table.tobytes().decode("ascii")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="dump DWARF package file index sections"
@@ -39,6 +82,10 @@ def main() -> None:
     args = parser.parse_args()
 
     with open(args.path, "rb") as f:
+        # Read the index sections directly from the mapped file rather than
+        # copying them. This isn't closed explicitly because the tables are
+        # views of it.
+        mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
         elf = ELFFile(f)
         byteorder = "little" if elf.little_endian else "big"
 
@@ -47,8 +94,13 @@ def main() -> None:
             if scn is None:
                 continue
 
-            data = scn.data()
-            view = memoryview(data)
+            # pyelftools needs to decompress compressed sections for us.
+            if scn["sh_flags"] & SH_FLAGS.SHF_COMPRESSED:
+                data = memoryview(scn.data())
+            else:
+                data = memoryview(mm)[
+                    scn["sh_offset"] : scn["sh_offset"] + scn["sh_size"]
+                ]
 
             print("Section", section_name)
 
@@ -92,57 +144,44 @@ def main() -> None:
                 print("error: section is truncated", file=sys.stderr)
                 continue
 
-            hash_table = array("Q")
-            hash_table.frombytes(view[hash_table_start:hash_table_end])
-            index_table = array("I")
-            index_table.frombytes(view[index_table_start:index_table_end])
-            section_table_header = array("I")
-            section_table_header.frombytes(
-                view[section_table_header_start:section_table_header_end]
+            uint32 = numpy.dtype("<u4" if elf.little_endian else ">u4")
+            uint64 = numpy.dtype("<u8" if elf.little_endian else ">u8")
+            hash_table = numpy.frombuffer(data[hash_table_start:hash_table_end], uint64)
+            index_table = numpy.frombuffer(
+                data[index_table_start:index_table_end], uint32
             )
-            section_offset_table = array("I")
-            section_offset_table.frombytes(
-                view[section_offset_table_start:section_offset_table_end]
+            section_table_header = numpy.frombuffer(
+                data[section_table_header_start:section_table_header_end], uint32
             )
-            section_size_table = array("I")
-            section_size_table.frombytes(
-                view[section_size_table_start:section_size_table_end]
-            )
-            if byteorder != sys.byteorder:
-                hash_table.byteswap()
-                index_table.byteswap()
-                section_table_header.byteswap()
-                section_offset_table.byteswap()
-                section_size_table.byteswap()
+            section_offset_table = numpy.frombuffer(
+                data[section_offset_table_start:section_offset_table_end], uint32
+            ).reshape(unit_count, section_count)
+            section_size_table = numpy.frombuffer(
+                data[section_size_table_start:section_size_table_end], uint32
+            ).reshape(unit_count, section_count)
 
             print("  Hash Table")
             print("        Slot Signature          Unit")
-            for i in range(slot_count):
-                print(f"  {i:10} ", end="")
-                signature = hash_table[i]
-                row = index_table[i]
-                if signature == 0 and row == 0:
-                    print()
-                else:
-                    print(f"0x{signature:016x} {row}")
+            # Most slots are usually empty, so only look up the used ones.
+            lines = [f"  {i:10} \n" for i in range(slot_count)]
+            for i in numpy.flatnonzero((hash_table != 0) | (index_table != 0)):
+                lines[i] = f"  {i:10} 0x{hash_table[i]:016x} {index_table[i]}\n"
+            sys.stdout.write("".join(lines))
 
             print("  Section Table")
-            print("        Unit ", end="")
-            for section in section_table_header:
+            header = ["        Unit "]
+            for section in section_table_header.tolist():
                 try:
                     name = DW_SECT[version][section]
                 except KeyError:
                     name = str(section)
-                print(f"{name:22}", end="")
-            print()
-
-            for i in range(unit_count):
-                print(f"  {i + 1:10} ", end="")
-                for j in range(section_count):
-                    offset = section_offset_table[i * section_count + j]
-                    size = section_size_table[i * section_count + j]
-                    print(f"0x{offset:08x}+0x{size:08x} ", end="")
-                print()
+                header.append(f"{name:22}")
+            header.append("\n")
+            sys.stdout.write("".join(header))
+
+            sys.stdout.write(
+                format_section_table(section_offset_table, section_size_table)
+            )
 
 
 if __name__ == "__main__":
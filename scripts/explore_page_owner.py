@@ -4,7 +4,6 @@
 
 import argparse
 from collections import Counter
-import re
 import sys
 
 
@@ -31,18 +30,21 @@ def sort_stack_traces(file):
             stack_traces[tuple(reversed(current_stack_trace))] += current_size
         current_stack_trace.clear()
 
+    # Most lines are stack trace entries like " func+0x10/0x20 [module]", so
+    # avoid regular expressions in this loop.
+    order_prefix = 'Page allocated via order '
     for line in file:
         if line.startswith('PFN'):
             continue
-        match = re.match(r'Page allocated via order (\d+)', line)
-        if match:
+        if line.startswith(order_prefix):
             if current_stack_trace:
                 add_stack_trace()
-            current_size = 4096 << int(match.group(1))
+            order = line[len(order_prefix):].partition(',')[0]
+            current_size = 4096 << int(order)
         elif line != '\n':
-            match = re.match(r'\s*([^+\s]+)', line)
-            if match.group(1) != '__set_page_owner':
-                current_stack_trace.append(match.group(1))
+            func = line.split(None, 1)[0].partition('+')[0]
+            if func != '__set_page_owner':
+                current_stack_trace.append(func)
     if current_stack_trace:
         add_stack_trace()
     return stack_traces
@@ -54,11 +56,18 @@ prev_response = None
 def explore(stack_traces, level, name=None):
     global prev_response
 
+    # Group the stack traces by callee while we add up the sizes so that
+    # exploring a callee (possibly more than once) doesn't need to filter all of
+    # the stack traces again.
+    total_size = 0
     callees = Counter()
-    for stack_trace, size in stack_traces.items():
+    callee_stack_traces = {}
+    for stack_trace, size in stack_traces:
+        total_size += size
         if level < len(stack_trace):
-            callees[stack_trace[level]] += size
-    total_size = sum(stack_traces.values())
+            func = stack_trace[level]
+            callees[func] += size
+            callee_stack_traces.setdefault(func, []).append((stack_trace, size))
     callee_size = sum(callees.values())
     sorted_callees = callees.most_common()
     while True:
@@ -96,11 +105,7 @@ def explore(stack_traces, level, name=None):
             print('Out of bounds index', file=sys.stderr)
             continue
         func = sorted_callees[i - 1][0]
-        new_stack_traces = Counter({
-            stack_trace: size for stack_trace, size in stack_traces.items()
-            if level < len(stack_trace) and stack_trace[level] == func
-        })
-        explore(new_stack_traces, level + 1, func)
+        explore(callee_stack_traces[func], level + 1, func)
 
 
 def main():
@@ -112,9 +117,9 @@ def main():
     args = parser.parse_args()
 
     print('Sorting stack traces...')
-    with open(args.page_owner, 'r') as f:
+    with open(args.page_owner, 'r', buffering=1024 * 1024) as f:
         stack_traces = sort_stack_traces(f)
-    explore(stack_traces, level=0)
+    explore(list(stack_traces.items()), level=0)
 
 
 if __name__ == '__main__':
@@ -19,32 +19,43 @@ def cycle_mount_btrfsck(dev, mnt):
     subprocess.check_call(['mount', '--', dev, mnt])
 
 
-def create_files(test_dir, sectorsize, numfiles):
-    os.chdir(test_dir)
-    for i in range(numfiles):
-        if i % 2048 == 0:
-            print('Created {}/{} files...'.format(i, numfiles), end='\r')
-        fd = os.open(str(i), os.O_WRONLY | os.O_CREAT)
-        try:
-            os.posix_fallocate(fd, 0, sectorsize)
-        finally:
-            os.close(fd)
+def create_files(test_dir, sectorsize, names):
+    numfiles = len(names)
+    # Create the files relative to a directory file descriptor. It's closed
+    # when we're done so that the filesystem can be unmounted between steps.
+    dir_fd = os.open(test_dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for i, name in enumerate(names):
+            if i % 2048 == 0:
+                print('Created {}/{} files...'.format(i, numfiles), end='\r')
+            fd = os.open(name, os.O_WRONLY | os.O_CREAT, dir_fd=dir_fd)
+            try:
+                os.posix_fallocate(fd, 0, sectorsize)
+            finally:
+                os.close(fd)
+    finally:
+        os.close(dir_fd)
     print('Created {0}/{0} files...'.format(numfiles))
-    os.chdir('/')
 
 
-def unlink_every_other_file(test_dir, numfiles):
-    os.chdir(test_dir)
-    for i in range(0, numfiles, 2):
-        if i % 4096 == 0:
-            print('Unlinked {}/{} files...'.format(i // 2, numfiles // 2), end='\r')
-        os.unlink(str(i))
+def unlink_every_other_file(test_dir, names):
+    numfiles = len(names)
+    dir_fd = os.open(test_dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for i in range(0, numfiles, 2):
+            if i % 4096 == 0:
+                print('Unlinked {}/{} files...'.format(i // 2, numfiles // 2), end='\r')
+            os.unlink(names[i], dir_fd=dir_fd)
+    finally:
+        os.close(dir_fd)
     print('Unlinked {0}/{0} files...'.format(numfiles // 2))
-    os.chdir('/')
 
 
 def benchmark(args):
     numfiles = (args.chunks * CHUNK_SIZE) // args.sectorsize
+    # Format the file names once up front rather than in the create and unlink
+    # loops.
+    names = [b'%d' % i for i in range(numfiles)]
 
     print('Creating filesystem...')
     try:
@@ -65,14 +76,14 @@ def benchmark(args):
         os.mkdir(test_dir)
 
         # Create a bunch of sectorsize files.
-        create_files(test_dir, args.sectorsize, numfiles)
+        create_files(test_dir, args.sectorsize, names)
         if args.check:
             cycle_mount_btrfsck(args.dev, args.mnt)
 
         # This will more or less free every other sector in the data block
         # group, which is the worst case for extents. At some point, we'll
         # convert over to bitmaps.
-        unlink_every_other_file(test_dir, numfiles)
+        unlink_every_other_file(test_dir, names)
         if args.check:
             cycle_mount_btrfsck(args.dev, args.mnt)
 
@@ -84,7 +95,6 @@ def benchmark(args):
         print('Removing everything else...')
         shutil.rmtree(test_dir)
     finally:
-        os.chdir('/')
         subprocess.call(['umount', '--', args.mnt])
     if args.check:
         subprocess.check_call(['btrfs', 'check', '--', args.dev])
@@ -3,57 +3,78 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import mmap
 import struct
 import sys
 
 
-def dump_node(f, offset, depth, prefix):
-    if offset & 0x0fffffff == 0:
-        return
-    f.seek(offset & 0x0fffffff)
-
-    if offset & 0x80000000:
-        while True:
-            c = f.read(1)[0]
-            if not c:
-                break
-            prefix += chr(c)
-
-    if offset & 0x20000000:
-        first = f.read(1)[0]
-        last = f.read(1)[0]
-        for i in range(last - first + 1):
-            buf = f.read(4)
-            pos = f.tell()
-            dump_node(f, struct.unpack('>I', buf)[0], depth + 1,
-                      prefix + chr(first + i))
-            f.seek(pos)
-
-    print('  ' * depth + prefix, end='')
-    if offset & 0x40000000:
-        print(' ->')
-        value_count = struct.unpack('>I', f.read(4))[0]
-        for i in range(value_count):
-            priority = struct.unpack('>I', f.read(4))[0]
-            value = ''
-            while True:
-                c = f.read(1)[0]
-                if not c:
-                    break
-                value += chr(c)
-            print('  ' * (depth + 1), priority, value)
-    else:
-        print()
-
-
-def dump_index(f):
-    magic = struct.unpack('>I', f.read(4))[0]
+_u32 = struct.Struct('>I')
+
+
+def read_u32(buf, offset):
+    return _u32.unpack_from(buf, offset)[0]
+
+
+def read_string(buf, offset):
+    end = buf.find(b'\0', offset)
+    if end < 0:
+        raise ValueError('unterminated string')
+    return buf[offset:end].decode('latin-1'), end + 1
+
+
+def dump_node(buf, offset, depth, prefix):
+    # Children are printed before their parent. Rather than recursing, keep a
+    # stack of nodes to visit and of output that is ready once the children
+    # above it on the stack have been printed.
+    stack = [(offset, depth, prefix)]
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, str):
+            sys.stdout.write(entry)
+            continue
+        offset, depth, prefix = entry
+        pos = offset & 0x0fffffff
+        if pos == 0:
+            continue
+
+        if offset & 0x80000000:
+            s, pos = read_string(buf, pos)
+            prefix += s
+
+        children = []
+        if offset & 0x20000000:
+            first = buf[pos]
+            last = buf[pos + 1]
+            end = pos + 2 + 4 * (last - first + 1)
+            for i, (child,) in enumerate(_u32.iter_unpack(buf[pos + 2:end])):
+                children.append((child, depth + 1, prefix + chr(first + i)))
+            pos = end
+
+        output = '  ' * depth + prefix
+        if offset & 0x40000000:
+            output += ' ->\n'
+            value_count = read_u32(buf, pos)
+            pos += 4
+            indent = '  ' * (depth + 1)
+            for i in range(value_count):
+                priority = read_u32(buf, pos)
+                value, pos = read_string(buf, pos + 4)
+                output += f'{indent} {priority} {value}\n'
+        else:
+            output += '\n'
+
+        stack.append(output)
+        stack.extend(reversed(children))
+
+
+def dump_index(buf):
+    magic = read_u32(buf, 0)
     assert magic == 0xb007f457
 
-    version = struct.unpack('>I', f.read(4))[0]
+    version = read_u32(buf, 4)
     assert version == (2 << 16) | 1
 
-    dump_node(f, struct.unpack('>I', f.read(4))[0], 0, '')
+    dump_node(buf, read_u32(buf, 8), 0, '')
 
 
 if __name__ == '__main__':
@@ -62,5 +83,6 @@ if __name__ == '__main__':
     parser.add_argument('path', type=str, help='file path')
     args = parser.parse_args()
 
-    with open(args.path, 'rb') as f:
-        dump_index(f)
+    with open(args.path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+        dump_index(mm)
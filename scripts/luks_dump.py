@@ -3,11 +3,29 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import mmap
 import struct
+import sys
+
+
+PHDR_STRUCT = struct.Struct('>6sH32s32s32sII20s32sI40s')
+KEY_SLOT_STRUCT = struct.Struct('>II32sII')
+NUM_KEY_SLOTS = 8
+
+
+# Map the header so that we can parse it straight from the page cache. Fall back
+# to reading it for files that can't be mapped (or are too short, in which case
+# parsing fails later).
+def read_header(f):
+    size = PHDR_STRUCT.size + NUM_KEY_SLOTS * KEY_SLOT_STRUCT.size
+    try:
+        return mmap.mmap(f.fileno(), size, prot=mmap.PROT_READ)
+    except (OSError, ValueError):
+        return f.read(size)
 
 
 def c_string(b):
-    return b[:b.index(0)].decode('ascii')
+    return b.split(b'\0', 1)[0].decode('ascii')
 
 
 def main():
@@ -18,6 +36,8 @@ def main():
     args = parser.parse_args()
 
     with open(args.dev, 'rb') as f:
+        # The key slots immediately follow the PHDR, so read both at once.
+        buf = read_header(f)
         (
             magic,
             version,
@@ -30,11 +50,11 @@ def main():
             mk_digest_salt,
             mk_digest_iter,
             uuid,
-        ) = struct.unpack_from('>6sH32s32s32sII20s32sI40s', f.read(208))
+        ) = PHDR_STRUCT.unpack_from(buf)
 
         assert magic == b'LUKS\xba\xbe'
         assert version == 1
-        print(f"""\
+        out = [f"""\
 PHDR
   magic = {repr(magic)[2:-1]}
   version = {version}
@@ -46,18 +66,21 @@ PHDR
   mk_digest = {mk_digest.hex()}
   mk_digest_salt = {mk_digest_salt.hex()}
   mk_digest_iter = {mk_digest_iter}
-  uuid = {c_string(uuid)}""")
+  uuid = {c_string(uuid)}"""]
 
-        for i, key_slot in enumerate(struct.iter_unpack('>II32sII', f.read(384)), 1):
-            active, iterations, salt, key_material_offset, stripes = key_slot
+        for i in range(NUM_KEY_SLOTS):
+            active, iterations, salt, key_material_offset, stripes = (
+                KEY_SLOT_STRUCT.unpack_from(buf, PHDR_STRUCT.size + i * KEY_SLOT_STRUCT.size)
+            )
             if args.all_key_slots or active == 0xac71f3:
-                print(f"""\
-  Key Slot {i}
+                out.append(f"""\
+  Key Slot {i + 1}
     active = 0x{active:x}
     iterations = {iterations}
     salt = {salt.hex()}
     key_material_offset = {key_material_offset}
     stripes = {stripes}""")
+        sys.stdout.write('\n'.join(out) + '\n')
 
 
 if __name__ == '__main__':
@@ -6,7 +6,6 @@ import argparse
 from collections import namedtuple
 import ctypes
 import os
-import re
 import sys
 
 
@@ -31,13 +30,6 @@ def umount(target, flags=0):
         raise OSError(errno, os.strerror(errno))
 
 
-MOUNTINFO_RE = re.compile(
-    rb'(?P<mount_id>\d+) (?P<parent_id>\d+) (?P<major>\d+):(?P<minor>\d+) '
-    rb'(?P<root>[^ ]+) (?P<mount_point>[^ ]+) (?P<mount_options>[^ ]+) '
-    rb'(?P<optional>.*) - (?P<fs_type>[^ ]+) (?P<source>[^ ]+) '
-    rb'(?P<super_options>[^ ]+)\n')
-
-
 Mount = namedtuple('Mount', [
     'mount_id',
     'parent_id',
@@ -53,30 +45,38 @@ Mount = namedtuple('Mount', [
 ])
 
 
+# Parse mountinfo by hand; there is a line for every mount in every namespace,
+# and this is much cheaper than matching a regular expression against each
+# one. None of the fields contain unescaped spaces, and the optional fields are
+# terminated by a lone "-".
 def mounts(pid='self'):
     with open(f'/proc/{pid}/mountinfo', 'rb') as f:
         for line in f:
-            match = MOUNTINFO_RE.fullmatch(line)
-            assert match
+            pre, sep, post = line.rstrip(b'\n').partition(b' - ')
+            fields = pre.split(b' ', 6)
+            super_fields = post.split(b' ', 2)
+            assert sep and len(fields) >= 6 and len(super_fields) == 3
+            major, minor = fields[2].split(b':')
             optional = []
-            for field in match['optional'].split():
-                if b':' in field:
-                    tag, value = field.split(b':', 1)
-                    optional.append((tag.decode('unicode-escape'), value.decode('unicode-escape')))
-                else:
-                    optional.append((field.decode('unicode-escape'), None))
+            if len(fields) > 6:
+                for field in fields[6].split():
+                    if b':' in field:
+                        tag, value = field.split(b':', 1)
+                        optional.append((tag.decode('unicode-escape'), value.decode('unicode-escape')))
+                    else:
+                        optional.append((field.decode('unicode-escape'), None))
             yield Mount(
-                mount_id=int(match['mount_id']),
-                parent_id=int(match['parent_id']),
-                major=int(match['major']),
-                minor=int(match['minor']),
-                root=match['root'].decode('unicode-escape'),
-                mount_point=match['mount_point'].decode('unicode-escape'),
-                mount_options=match['mount_options'].decode('unicode-escape'),
+                mount_id=int(fields[0]),
+                parent_id=int(fields[1]),
+                major=int(major),
+                minor=int(minor),
+                root=fields[3].decode('unicode-escape'),
+                mount_point=fields[4].decode('unicode-escape'),
+                mount_options=fields[5].decode('unicode-escape'),
                 optional=optional,
-                fs_type=match['fs_type'].decode('unicode-escape'),
-                source=match['source'].decode('unicode-escape'),
-                super_options=match['super_options'].decode('unicode-escape'),
+                fs_type=super_fields[0].decode('unicode-escape'),
+                source=super_fields[1].decode('unicode-escape'),
+                super_options=super_fields[2].decode('unicode-escape'),
             )
 
 
@@ -97,7 +97,15 @@ def main():
         mnt_ns = -1
         pid_ns = -1
         try:
-            mnt_ns = os.open(os.path.join(dir.path, 'ns', 'mnt'), os.O_RDONLY)
+            # Most processes share a few mount namespaces, so check whether
+            # we've already seen this one before opening anything.
+            mnt_ns_path = os.path.join(dir.path, 'ns', 'mnt')
+            if os.stat(mnt_ns_path).st_ino in namespaces:
+                continue
+
+            # The process may have switched namespaces since we checked, so
+            # check again with the namespace that we actually opened.
+            mnt_ns = os.open(mnt_ns_path, os.O_RDONLY)
             mnt_ns_ino = os.fstat(mnt_ns).st_ino
             if mnt_ns_ino in namespaces:
                 continue
@@ -4,13 +4,15 @@
 
 import argparse
 import math
+import os
 import re
-import struct
 import subprocess
 import sys
 import time
 from types import SimpleNamespace
 
+import numpy
+
 
 def humanize(number, unit="", precision=1):
     n = float(number)
@@ -25,27 +27,77 @@ def humanize(number, unit="", precision=1):
     return f"{n:.{precision}f}{prefix}{unit}"
 
 
-def get_seq(dev, ino):
+def get_seq(output):
+    match = re.search(f"^core.atime.sec = (.*)$", output, flags=re.M)
+    return int(time.mktime(time.strptime(match.group(1))))
+
+
+_BMAP_RE = re.compile(
+    r"^data offset (\d+) startblock \d+ \((\d+)/(\d+)\) count (\d+) flag (\d+)$",
+    flags=re.M,
+)
+
+
+# Read the data of an inode directly from the device using its block map.
+# Returns None if the block map couldn't be parsed.
+def read_rt_inode_direct(dev, sb, ino, blocks):
     output = subprocess.check_output(
-        ["xfs_db", "-r", dev, "-c", f"inode {ino}", "-c", "p core.atime"],
+        ["xfs_db", "-r", dev, "-c", f"inode {ino}", "-c", "bmap"],
         universal_newlines=True,
     )
-    match = re.search(f"^core.atime.sec = (.*)$", output, flags=re.M)
-    return int(time.mktime(time.strptime(match.group(1))))
+    extents = [
+        tuple(int(x) for x in match.groups()) for match in _BMAP_RE.finditer(output)
+    ]
+    if not extents:
+        return None
+    # Holes and unwritten extents read as zeroes.
+    data = bytearray(blocks * sb.blocksize)
+    view = memoryview(data)
+    with open(dev, "rb") as f:
+        for offset, agno, agbno, count, flag in extents:
+            count = min(count, blocks - offset)
+            if count <= 0 or flag:
+                continue
+            start = offset * sb.blocksize
+            end = start + count * sb.blocksize
+            pos = (agno * sb.agblocks + agbno) * sb.blocksize
+            while start < end:
+                n = os.preadv(f.fileno(), [view[start:end]], pos)
+                if n == 0:
+                    raise EOFError(f"short read from {dev}")
+                start += n
+                pos += n
+    return data
+
 
+def read_rt_inode(dev, sb, ino, blocks):
+    data = read_rt_inode_direct(dev, sb, ino, blocks)
+    if data is not None:
+        return data
 
-def read_rt_inode(dev, ino, blocks):
+    # Fall back to parsing a hexdump of each block.
     cmd = ["xfs_db", "-r", dev, "-c", f"inode {ino}"]
     for block in range(blocks):
         cmd.append("-c")
         cmd.append(f"dblock {block}")
         cmd.append("-c")
         cmd.append("p")
+    # Each line looks like "offset: xx xx ...". Parse the output as xfs_db
+    # prints it rather than buffering all of it, and convert the hex bytes in
+    # batches of lines. fromhex() skips the spaces and newlines between bytes.
     data = bytearray()
-    for line in subprocess.check_output(cmd, universal_newlines=True).splitlines():
-        match = re.match("[0-9a-fA-F]+: ((?: [0-9a-fA-F]{2})+)", line)
-        hexdump = match.group(1).replace(" ", "")
-        data.extend(bytes.fromhex(hexdump))
+    hexdump = []
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True) as proc:
+        for line in proc.stdout:
+            offset, sep, line_hexdump = line.partition(": ")
+            if sep:
+                hexdump.append(line_hexdump)
+                if len(hexdump) >= 4096:
+                    data += bytes.fromhex("".join(hexdump))
+                    hexdump.clear()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    data += bytes.fromhex("".join(hexdump))
     return data
 
 
@@ -90,7 +142,7 @@ def print_rsum(sb, rsum):
         return humanize((sb.blocksize * sb.rextsize) << i, "B")
 
     size_max_len = max(len(size(i)) for i in range(len(rsum)))
-    columns_max = [max(level[bbno] for level in rsum) for bbno in range(len(rsum[0]))]
+    columns_max = rsum.max(axis=0).tolist()
     columns_max_len = [
         max(len(str(bbno)), len(str(n))) for bbno, n in enumerate(columns_max)
     ]
@@ -101,7 +153,7 @@ def print_rsum(sb, rsum):
             print(f"{bbno:>{columns_max_len[bbno] + 1}}", end="")
     print()
 
-    for i, level in enumerate(rsum):
+    for i, level in enumerate(rsum.tolist()):
         print(f"{size(i):<{size_max_len}}", end="")
         for bbno, n in enumerate(level):
             if columns_max[bbno]:
@@ -114,24 +166,30 @@ def print_rsum(sb, rsum):
 
 
 def create_rsum(sb, rbm):
-    rsum = [[0] * sb.rbmblocks for _ in range(sb.rsumlevels)]
-    prev = False
-    for i, word in enumerate(rbm):
-        for j in range(32):
-            cur = bool(word & (1 << j))
-            if cur != prev:
-                pos = 32 * i + j
-                if cur:
-                    start = pos
-                else:
-                    end = pos
-                    rsum[(end - start).bit_length() - 1][
-                        start // 8 // sb.blocksize
-                    ] += 1
-            prev = cur
-    if prev:
-        end = 32 * len(rbm)
-        rsum[(end - start).bit_length() - 1][start // 8 // sb.blocksize] += 1
+    # Bit j of word i of the bitmap is set if realtime extent 32 * i + j is
+    # free. Rather than checking every bit, find the bits where a free run
+    # starts or ends: those that differ from the previous bit (with the bit
+    # before the first extent considered allocated).
+    carry = numpy.zeros_like(rbm)
+    carry[1:] = rbm[:-1] >> 31
+    edges = rbm ^ ((rbm << 1) | carry)
+    edge_words = numpy.flatnonzero(edges)
+    edge_bits = numpy.unpackbits(
+        edges[edge_words].astype("<u4").view(numpy.uint8), bitorder="little"
+    ).reshape(-1, 32)
+    word_indices, bit_indices = numpy.nonzero(edge_bits)
+    positions = 32 * edge_words[word_indices] + bit_indices
+
+    # The edges alternate between the start of a free run and its end.
+    starts = positions[0::2]
+    ends = positions[1::2]
+    if len(ends) < len(starts):
+        ends = numpy.append(ends, 32 * len(rbm))
+    # frexp() gives the bit length of the run lengths.
+    levels = numpy.frexp(ends - starts)[1] - 1
+
+    rsum = numpy.zeros((sb.rsumlevels, sb.rbmblocks), dtype=numpy.int32)
+    numpy.add.at(rsum, (levels, starts // 8 // sb.blocksize), 1)
     return rsum
 
 
@@ -150,8 +208,23 @@ def main():
     )
     args = parser.parse_args()
 
+    # Get the realtime bitmap inode's atime (see get_seq()) in the same xfs_db
+    # invocation as the superblock by following the superblock's pointer to it.
     sb_output = subprocess.check_output(
-        ["xfs_db", "-r", args.dev, "-c", "sb", "-c", "p"], universal_newlines=True
+        [
+            "xfs_db",
+            "-r",
+            args.dev,
+            "-c",
+            "sb",
+            "-c",
+            "p",
+            "-c",
+            "addr rbmino",
+            "-c",
+            "p core.atime",
+        ],
+        universal_newlines=True,
     )
     fields = [
         "blocksize",  # Filesystem block size in bytes.
@@ -161,6 +234,7 @@ def main():
         "rextsize",  # Realtime extent size in blocks.
         "rbmblocks",  # Size of the realtime bitmap in blocks.
         "rextslog",  # log2(rextents)
+        "agblocks",  # Size of an allocation group in blocks.
     ]
     regex = r"^(" + "|".join(fields) + r") = (.*)$"
     sb = SimpleNamespace()
@@ -172,7 +246,7 @@ def main():
     # Size of the realtime summary in bytes.
     sb.rsumsize = 4 * sb.rsumlevels * sb.rbmblocks
 
-    seq = get_seq(args.dev, sb.rbmino)
+    seq = get_seq(sb_output)
 
     """
     The storage unit for an XFS filesystem is called a block. A block is
@@ -208,12 +282,11 @@ def main():
     """
 
     rsumdata = read_rt_inode(
-        args.dev, sb.rsumino, math.ceil(sb.rsumsize / sb.blocksize)
-    )
-    del rsumdata[sb.rsumsize :]
-    rsum = list(
-        list(level) for level in struct.iter_unpack(f"{sb.rbmblocks}i", rsumdata)
+        args.dev, sb, sb.rsumino, math.ceil(sb.rsumsize / sb.blocksize)
     )
+    rsum = numpy.frombuffer(
+        rsumdata, dtype=numpy.int32, count=sb.rsumlevels * sb.rbmblocks
+    ).reshape(sb.rsumlevels, sb.rbmblocks)
 
     print_overview(sb, seq)
 
@@ -222,10 +295,10 @@ def main():
         print_rsum(sb, rsum)
 
     if args.verify_summary:
-        rbmdata = read_rt_inode(args.dev, sb.rbmino, sb.rbmblocks)
-        rbm = list(struct.unpack(f"{sb.rbmblocks * sb.blocksize // 4}I", rbmdata))
+        rbmdata = read_rt_inode(args.dev, sb, sb.rbmino, sb.rbmblocks)
+        rbm = numpy.frombuffer(rbmdata, dtype=numpy.uint32)
         expected_rsum = create_rsum(sb, rbm)
-        if expected_rsum != rsum:
+        if not numpy.array_equal(expected_rsum, rsum):
             sys.exit("realtime summary does not match realtime bitmap")
 
 